@@ -1,19 +1,24 @@
 import sys
 import os
+import io
 import subprocess
 import time
 import logging
 import traceback
-import magic
+import gc
+import functools
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict
 from datetime import datetime
+from types import MappingProxyType
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QPushButton, QProgressBar,
                           QVBoxLayout, QHBoxLayout, QWidget, QLabel, QFileDialog,
                           QMessageBox, QTextEdit, QCheckBox)
-from PyQt6.QtCore import Qt, QMimeData, QThread, pyqtSignal, QSize
-from PyQt6.QtGui import QDragEnterEvent, QDropEvent, QIcon
-from PIL import Image
+from PyQt6.QtCore import Qt, QMimeData, QThread, QTimer, pyqtSignal, QSize
+from PyQt6.QtGui import QDragEnterEvent, QDropEvent, QIcon, QTextCursor
 import shutil
-from webptools import dwebp  # 导入webptools库
 
 # 设置日志
 log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
@@ -30,6 +35,92 @@ logging.basicConfig(
 )
 logger = logging.getLogger('webp2gif')
 
+# ConversionWorker.log 使用的日志级别名称
+LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
+# 背景图缓冲池：最多缓存的尺寸种类数，以及每种尺寸最多缓存的图像数
+BG_POOL_MAX_SIZES = 4
+BG_POOL_MAX_PER_SIZE = 2
+
+# 发送到界面的日志按批合并：累计达到一定条数时由工作线程发送，
+# 其余由界面线程的定时器按固定间隔（秒）取出
+LOG_FLUSH_LINES = 10
+LOG_FLUSH_INTERVAL = 0.1
+
+# 界面日志文本框最多保留的行数
+LOG_MAX_BLOCKS = 2000
+
+# 构建动画共用调色板时最多抽样的帧数，以及每个抽样帧缩放后的最大边长
+PALETTE_SAMPLE_FRAMES = 16
+PALETTE_SAMPLE_TILE = 128
+
+# 每转换多少个文件执行一次垃圾回收，及时释放解码器占用的内存
+GC_COLLECT_EVERY = 16
+
+@functools.lru_cache(maxsize=1)
+def check_tools():
+    """检查转换工具是否可用，结果在进程内缓存，供所有文件和工作线程共享"""
+    tools_status = {}
+    
+    # 检查ffmpeg：只在PATH中查找，不启动进程
+    ffmpeg_path = shutil.which('ffmpeg')
+    if ffmpeg_path:
+        logger.info(f"检测到ffmpeg: {ffmpeg_path}")
+        tools_status['ffmpeg'] = True
+    else:
+        logger.info("未检测到ffmpeg")
+        tools_status['ffmpeg'] = False
+    
+    # 检查PyAV（可选，进程内调用libav，无需为每个文件启动ffmpeg进程）
+    try:
+        import av
+        logger.info(f"检测到PyAV: {av.__version__}")
+        tools_status['pyav'] = True
+    except ImportError:
+        logger.info("未检测到PyAV")
+        tools_status['pyav'] = False
+    except Exception as e:
+        logger.error(f"检测PyAV时出错: {str(e)}")
+        tools_status['pyav'] = False
+    
+    # 检查dwebp (libwebp命令行工具)，仅在PIL无法解码时作为后备
+    dwebp_path = shutil.which('dwebp')
+    if dwebp_path:
+        logger.info(f"检测到dwebp: {dwebp_path}")
+        tools_status['dwebp'] = True
+    else:
+        logger.info("未检测到dwebp")
+        tools_status['dwebp'] = False
+    
+    return MappingProxyType(tools_status)
+
+@functools.lru_cache(maxsize=1)
+def get_ffmpeg_version():
+    """获取ffmpeg版本信息，需要启动一次ffmpeg进程，仅在调试模式下调用"""
+    try:
+        result = subprocess.run(['ffmpeg', '-version'],
+                      stdout=subprocess.PIPE,
+                      stderr=subprocess.DEVNULL,
+                      check=False)
+        if result.returncode == 0:
+            return result.stdout.decode('utf-8', errors='ignore').splitlines()[0]
+        logger.warning("ffmpeg命令存在但返回非零退出码")
+    except Exception as e:
+        logger.error(f"获取ffmpeg版本时出错: {str(e)}")
+    return None
+
+def _size_or_none(path):
+    """返回文件大小，文件不存在或无法访问时返回None（只需一次stat调用）"""
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return None
+
 class ConversionWorker(QThread):
     progress = pyqtSignal(int)
     finished = pyqtSignal()
@@ -40,333 +131,529 @@ class ConversionWorker(QThread):
         super().__init__()
         self.files = files
         self.debug_mode = debug_mode
+        # 按尺寸缓存白色RGB背景图，避免每帧重新分配
+        self._bg_pool = OrderedDict()
+        self._bg_lock = threading.Lock()
+        # 待发送到界面的日志缓冲，减少跨线程信号数量
+        self._log_buf = []
+        self._log_lock = threading.Lock()
+        # 已创建的输出目录
+        self._mkdir_cache = set()
+        self._mkdir_lock = threading.Lock()
         logger.info(f"初始化转换工作线程，文件数量: {len(files)}")
         if self.debug_mode:
             logger.debug(f"文件列表: {', '.join(files)}")
 
-    def log(self, message, level='info'):
-        """统一的日志方法"""
-        if level == 'debug':
-            logger.debug(message)
-        elif level == 'warning':
-            logger.warning(message)
-        elif level == 'error':
-            logger.error(message)
-        else:
-            logger.info(message)
-            
-        # 发送日志消息到UI
-        if self.debug_mode or level == 'error' or level == 'warning':
-            self.log_message.emit(message)
+    def log(self, message, *args, level='info'):
+        """统一的日志方法，message可带%格式参数，仅在确实需要输出时才格式化"""
+        level_no = LOG_LEVELS.get(level, logging.INFO)
+        logger.log(level_no, message, *args)
+        
+        # 发送日志消息到UI，警告和错误立即发送，其余按批合并
+        if (self.debug_mode or level == 'error' or level == 'warning') and logger.isEnabledFor(level_no):
+            if args:
+                message = message % args
+            with self._log_lock:
+                self._log_buf.append(message)
+                if level in ('error', 'warning') or len(self._log_buf) >= LOG_FLUSH_LINES:
+                    self._flush_log_locked()
 
-    def check_tools(self):
-        """检查转换工具是否可用"""
-        tools_status = {}
+    def flush_log(self):
+        """将缓冲中的日志全部发送到UI，界面线程的定时器也会定期调用"""
+        with self._log_lock:
+            self._flush_log_locked()
+
+    def _flush_log_locked(self):
+        # 调用方需持有_log_lock，在锁内发送以保证日志顺序
+        if self._log_buf:
+            self.log_message.emit('\n'.join(self._log_buf))
+            self._log_buf.clear()
+
+    def _get_bg(self, size):
+        """从缓冲池取出指定尺寸的白色RGB背景图，池中没有时新建"""
+        bg = None
+        with self._bg_lock:
+            free = self._bg_pool.get(size)
+            if free:
+                bg = free.pop()
+                self._bg_pool.move_to_end(size)
+        if bg is None:
+            from PIL import Image
+            return Image.new("RGB", size, (255, 255, 255))
+        # 复用前重置为白色
+        bg.paste((255, 255, 255), (0, 0, size[0], size[1]))
+        return bg
+
+    def _put_bg(self, bg):
+        """将背景图归还缓冲池，超出容量的直接丢弃"""
+        with self._bg_lock:
+            free = self._bg_pool.setdefault(bg.size, [])
+            self._bg_pool.move_to_end(bg.size)
+            if len(free) < BG_POOL_MAX_PER_SIZE:
+                free.append(bg)
+            while len(self._bg_pool) > BG_POOL_MAX_SIZES:
+                self._bg_pool.popitem(last=False)
+
+    def _frame_to_rgb(self, img, bg, has_alpha):
+        """将img的当前帧转为RGB，含透明通道时合成到白色背景bg上并返回bg"""
+        if has_alpha:
+            # 确保帧被正确转换，已是RGBA时直接使用当前帧，避免多复制一份
+            frame = img if img.mode == 'RGBA' else img.convert('RGBA')
+            # 重置为白色背景后，以帧自身作为蒙版粘贴（PIL直接使用其alpha通道，无需单独提取）
+            bg.paste((255, 255, 255), (0, 0, bg.size[0], bg.size[1]))
+            bg.paste(frame, mask=frame)
+            return bg
+        return img if img.mode == 'RGB' else img.convert('RGB')
+
+    def _build_palette(self, img, bg, has_alpha):
+        """从均匀抽样的若干帧构建整段动画共用的调色板
+        
+        抽样帧缩小后拼接到一张图上统一量化，首帧中没有的颜色（如淡入、白色首帧）也能进入调色板。
+        """
+        from PIL import Image
+        
+        n_frames = img.n_frames
+        n_samples = min(n_frames, PALETTE_SAMPLE_FRAMES)
+        # 均匀抽样，始终包含首帧和末帧
+        indices = sorted({round(i * (n_frames - 1) / max(n_samples - 1, 1)) for i in range(n_samples)})
+        tile_w = min(img.size[0], PALETTE_SAMPLE_TILE)
+        tile_h = min(img.size[1], PALETTE_SAMPLE_TILE)
+        sample = Image.new("RGB", (tile_w * len(indices), tile_h), (255, 255, 255))
+        for i, frame_idx in enumerate(indices):
+            img.seek(frame_idx)
+            rgb = self._frame_to_rgb(img, bg, has_alpha)
+            # 最近邻缩放只取原有像素，不会引入插值产生的中间色
+            sample.paste(rgb.resize((tile_w, tile_h), Image.Resampling.NEAREST), (i * tile_w, 0))
+        self.log("调色板抽样帧: %s", indices, level='debug')
+        return sample.quantize(colors=256)
+
+    def _iter_frames(self, img, durations, has_alpha):
+        """逐帧读取动态WebP并产出调色板模式的帧，同时按帧号填写durations
         
-        # 检查ffmpeg
+        含透明通道时每帧先合成到同一张复用的白色背景上。整段动画共用一个由抽样帧
+        量化得到的调色板，各帧直接映射到该调色板，避免保存GIF时逐帧重新量化。
+        """
+        bg = self._get_bg(img.size) if has_alpha else None
         try:
-            result = subprocess.run(['ffmpeg', '-version'],
-                          stdout=subprocess.PIPE,
-                          stderr=subprocess.PIPE,
-                          check=False)
-            if result.returncode == 0:
-                ffmpeg_version = result.stdout.decode('utf-8', errors='ignore').splitlines()[0]
-                self.log(f"检测到ffmpeg: {ffmpeg_version}", 'info')
-                tools_status['ffmpeg'] = True
-            else:
-                self.log("ffmpeg命令存在但返回非零退出码", 'warning')
-                tools_status['ffmpeg'] = False
+            palette_img = self._build_palette(img, bg, has_alpha)
+            for frame_idx in range(img.n_frames):
+                img.seek(frame_idx)
+                # WebP插件在载入帧数据时才更新info['duration']，seek后需先load再读取
+                img.load()
+                duration = img.info.get('duration', 100)
+                durations[frame_idx] = duration
+                
+                rgb = self._frame_to_rgb(img, bg, has_alpha)
+                out = rgb.quantize(palette=palette_img)
+                
+                self.log("处理第 %d/%d 帧, 持续时间: %sms", frame_idx + 1, img.n_frames, duration, level='debug')
+                yield out
+        finally:
+            if bg is not None:
+                self._put_bg(bg)
+
+    def _av_frame_to_image(self, frame):
+        """将PyAV解码出的帧转为PIL图像，解码格式带透明通道时为RGBA模式，否则为RGB模式
+        
+        frame.to_image()只输出RGB，会丢失透明通道，因此带透明通道的帧需从rgba平面数据构建图像。
+        """
+        from PIL import Image
+        
+        if not any(component.is_alpha for component in frame.format.components):
+            return frame.to_image()
+        rgba = frame.reformat(format='rgba')
+        plane = rgba.planes[0]
+        return Image.frombytes('RGBA', (rgba.width, rgba.height), bytes(plane),
+                               'raw', 'RGBA', plane.line_size, 1)
+
+    def _iter_av_frames(self, container, stream, durations):
+        """逐帧解码并产出RGB图像，按相邻帧的时间戳差向durations追加每帧持续时间（毫秒）
+        
+        与_iter_frames相同，带透明通道的帧合成到同一张复用的白色背景上，产出的图像会被下一帧覆盖。
+        """
+        default_duration = int(1000 / stream.average_rate) if stream.average_rate else 100
+        bg = None
+        prev_image = None
+        prev_pts = None
+        
+        def to_rgb(image):
+            nonlocal bg
+            if image.mode != 'RGBA':
+                return image
+            if bg is None or bg.size != image.size:
+                if bg is not None:
+                    self._put_bg(bg)
+                bg = self._get_bg(image.size)
+            return self._frame_to_rgb(image, bg, True)
+        
+        try:
+            # 需要下一帧的时间戳才能算出当前帧的持续时间，因此延后一帧产出
+            for frame in container.decode(stream):
+                image = self._av_frame_to_image(frame)
+                if prev_image is not None:
+                    if frame.pts is not None and prev_pts is not None and stream.time_base:
+                        durations.append(int((frame.pts - prev_pts) * stream.time_base * 1000))
+                    else:
+                        durations.append(default_duration)
+                    yield to_rgb(prev_image)
+                prev_image, prev_pts = image, frame.pts
+            if prev_image is not None:
+                durations.append(default_duration)
+                yield to_rgb(prev_image)
+        finally:
+            if bg is not None:
+                self._put_bg(bg)
+
+    def _convert_with_pyav(self, file, output_path):
+        """使用PyAV在进程内解码并保存为GIF，返回是否生成了有效的输出文件
+        
+        只有一帧时与PIL路径一致，保存为不带帧时长的静态GIF。
+        """
+        import av
+        
+        durations = []
+        with av.open(file) as container:
+            stream = container.streams.video[0]
+            frame_iter = self._iter_av_frames(container, stream, durations)
+            try:
+                first_frame = next(frame_iter, None)
+                if first_frame is None:
+                    return False
+                # 首帧作为保存的主体图像，复制一份以免被后续帧复用的背景覆盖
+                first_frame = first_frame.copy()
+                second_frame = next(frame_iter, None)
+                if second_frame is None:
+                    first_frame.save(output_path, 'GIF')
+                else:
+                    first_frame.save(
+                        output_path,
+                        format='GIF',
+                        save_all=True,
+                        append_images=itertools.chain([second_frame], frame_iter),
+                        duration=durations,
+                        loop=0,
+                        disposal=2,
+                        optimize=False
+                    )
+            finally:
+                frame_iter.close()
+        return bool(_size_or_none(output_path))
+
+    def _convert_with_dwebp(self, file, output_path):
+        """使用dwebp解码为PNG并通过管道读入内存，再由PIL保存为GIF，不写临时文件"""
+        from PIL import Image
+        
+        cmd = ['dwebp', file, '-o', '-']
+        self.log("执行命令: %s", ' '.join(cmd), level='debug')
+        process = subprocess.run(cmd, check=True,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE if self.debug_mode else subprocess.DEVNULL)
+        if process.stderr:
+            self.log("dwebp输出: %s", process.stderr.decode('utf-8', errors='ignore'), level='debug')
+        
+        with Image.open(io.BytesIO(process.stdout)) as png_img:
+            png_img.save(output_path, 'GIF')
+        return bool(_size_or_none(output_path))
+
+    def _convert_one(self, file, index, total, tools):
+        """转换单个WebP文件，返回 (是否成功, 需要上报的错误信息)"""
+        # 图像处理库较重，延迟到真正转换时才导入，加快界面启动
+        from PIL import Image
+        
+        file_basename = os.path.basename(file)
+        self.log(f"处理文件 ({index}/{total}): {file_basename}", level='info')
+        
+        # 检查文件存在性、大小和文件头，只需一次打开、一次stat和一次读取，
+        # 在创建目录或启动任何转换工具之前排除无效文件
+        try:
+            with open(file, 'rb') as f:
+                file_size = os.fstat(f.fileno()).st_size
+                file_header = f.read(12)
         except FileNotFoundError:
-            self.log("未检测到ffmpeg", 'info')
-            tools_status['ffmpeg'] = False
-        except Exception as e:
-            self.log(f"检测ffmpeg时出错: {str(e)}", 'error')
-            tools_status['ffmpeg'] = False
+            error_msg = f"文件不存在: {file}"
+            self.log(error_msg, level='error')
+            return False, error_msg
+        except OSError as e:
+            error_msg = f"无法读取文件 {file_basename}: {str(e)}"
+            self.log(error_msg, level='error')
+            return False, error_msg
+            
+        self.log("文件大小: %d 字节", file_size, level='debug')
+        if file_size == 0:
+            error_msg = f"文件为空: {file_basename}"
+            self.log(error_msg, level='error')
+            return False, error_msg
+        
+        # 检测文件类型：WebP文件头为 RIFF....WEBP
+        self.log("文件头: %s", file_header.hex(), level='debug')
+        if file_header[:4] != b'RIFF' or file_header[8:12] != b'WEBP':
+            error_msg = f"文件 {file_basename} 不是有效的WebP文件，已跳过"
+            self.log(error_msg, level='error')
+            return False, error_msg
         
-        # 检查libwebp (webptools依赖)
+        # 创建输出目录
+        output_dir = os.path.join(os.path.dirname(file), 'result')
         try:
-            # 验证webptools是否可用
-            self.log("检查webptools工具...", 'info')
-            tools_status['webptools'] = True
+            # 同一批文件通常共用输出目录，已确认过的目录不再重复创建
+            with self._mkdir_lock:
+                if output_dir not in self._mkdir_cache:
+                    os.makedirs(output_dir, exist_ok=True)
+                    self._mkdir_cache.add(output_dir)
+                    self.log("创建或确认输出目录: %s", output_dir, level='debug')
         except Exception as e:
-            self.log(f"检测webptools时出错: {str(e)}", 'error')
-            tools_status['webptools'] = False
-            
-        return tools_status
-    
-    def run(self):
+            error_msg = f"创建输出目录失败: {str(e)}"
+            self.log(error_msg, level='error')
+            return False, error_msg
+        
+        # 转换文件
+        output_path = os.path.join(output_dir,
+                                 os.path.splitext(file_basename)[0] + '.gif')
+        self.log("输出路径: %s", output_path, level='debug')
+        
         try:
-            # 检查可用工具
-            tools = self.check_tools()
-            has_ffmpeg = tools.get('ffmpeg', False)
-            has_webptools = tools.get('webptools', False)
+            # 转换方法1：尝试使用PyAV在进程内转换（如果可用）
+            if tools.get('pyav', False):
+                self.log(f"使用PyAV转换文件: {file_basename}", level='info')
+                try:
+                    if self._convert_with_pyav(file, output_path):
+                        self.log(f"PyAV转换成功: {file_basename}", level='info')
+                        return True, None
+                    self.log(f"PyAV没有生成有效的输出文件: {file_basename}", level='warning')
+                except Exception as e:
+                    error_stack = traceback.format_exc()
+                    self.log(f"PyAV转换失败: {str(e)}", level='warning')
+                    self.log("错误堆栈: %s", error_stack, level='debug')
             
-            total = len(self.files)
-            success_count = 0
-            failed_count = 0
+            # 转换方法2：PyAV不可用或失败时，尝试使用ffmpeg命令行进行转换（如果可用）
+            if tools.get('ffmpeg', False):
+                self.log(f"使用ffmpeg转换文件: {file_basename}", level='info')
+                # cmd = ['ffmpeg', '-i', file, '-vf', 'split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse', '-y', output_path]
+                cmd = ['ffmpeg', '-i', file, '-y', output_path]                            
+                try:
+                    self.log("执行命令: %s", ' '.join(cmd), level='debug')
+                    # 仅在调试模式下捕获stderr，否则直接丢弃
+                    process = subprocess.run(cmd, check=True,
+                                             stdout=subprocess.DEVNULL,
+                                             stderr=subprocess.PIPE if self.debug_mode else subprocess.DEVNULL)
+                    stderr_output = process.stderr.decode('utf-8', errors='ignore') if process.stderr else ''
+                    
+                    # 检查输出文件是否存在且大小大于0
+                    output_size = _size_or_none(output_path)
+                    if output_size:
+                        self.log(f"ffmpeg转换成功: {file_basename} ({output_size} 字节)", level='info')
+                        return True, None
+                    else:
+                        error_msg = f"ffmpeg似乎运行成功，但没有生成有效的输出文件: {file_basename}"
+                        self.log(error_msg, level='error')
+                        self.log("ffmpeg错误输出: %s", stderr_output, level='debug')
+                except Exception as e:
+                    self.log(f"ffmpeg执行失败: {str(e)}", level='warning')
             
-            self.log(f"开始转换 {total} 个文件")
+            # 转换方法3：如果前面的方法都失败，尝试直接使用PIL
+            self.log(f"使用PIL尝试转换文件: {file_basename}", level='info')
+            pil_error_msg = f"无法转换文件: {file_basename}"
             
-            for i, file in enumerate(self.files, 1):
-                if file.lower().endswith('.webp'):
-                    file_basename = os.path.basename(file)
-                    self.log(f"处理文件 ({i}/{total}): {file_basename}", 'info')
+            try:
+                # 尝试用PIL打开
+                with Image.open(file) as img:
+                    self.log("PIL成功打开文件: %s, 格式: %s, 大小: %s", file_basename, img.format, img.size, level='debug')
                     
-                    # 检查文件存在性
-                    if not os.path.exists(file):
-                        error_msg = f"文件不存在: {file}"
-                        self.log(error_msg, 'error')
-                        self.error.emit(error_msg)
-                        failed_count += 1
-                        continue
-                        
-                    # 检查文件大小
-                    try:
-                        file_size = os.path.getsize(file)
-                        self.log(f"文件大小: {file_size} 字节", 'debug')
-                        if file_size == 0:
-                            error_msg = f"文件为空: {file_basename}"
-                            self.log(error_msg, 'error')
-                            self.error.emit(error_msg)
-                            failed_count += 1
-                            continue
-                    except Exception as e:
-                        self.log(f"获取文件大小时出错: {str(e)}", 'error')
+                    # 获取更多图像信息用于调试
+                    image_info = f"模式: {img.mode}, 格式: {img.format}"
+                    if hasattr(img, 'n_frames'):
+                        image_info += f", 帧数: {img.n_frames}"
+                    self.log("图像信息: %s", image_info, level='debug')
                     
-                    # 创建输出目录
-                    output_dir = os.path.join(os.path.dirname(file), 'result')
-                    try:
-                        os.makedirs(output_dir, exist_ok=True)
-                        self.log(f"创建或确认输出目录: {output_dir}", 'debug')
-                    except Exception as e:
-                        error_msg = f"创建输出目录失败: {str(e)}"
-                        self.log(error_msg, 'error')
-                        self.error.emit(error_msg)
-                        failed_count += 1
-                        continue
+                    # 检查是否为动态WebP
+                    is_animated = getattr(img, "is_animated", False)
+                    self.log("是否为动态WebP: %s", is_animated, level='debug')
                     
-                    # 转换文件
-                    output_path = os.path.join(output_dir,
-                                             os.path.splitext(file_basename)[0] + '.gif')
-                    self.log(f"输出路径: {output_path}", 'debug')
+                    # 不含透明通道的图像无需合成白色背景
+                    has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+                    self.log("是否含透明通道: %s", has_alpha, level='debug')
                     
-                    try:
-                        # 检测文件类型
-                        try:
-                            mime_type = magic.from_file(file, mime=True)
-                            self.log(f"检测到文件类型: {mime_type}", 'debug')
-                            if 'webp' not in mime_type.lower() and 'image' not in mime_type.lower():
-                                self.log(f"警告：文件 {file_basename} 可能不是真正的WebP文件 (MIME: {mime_type})", 'warning')
-                        except Exception as e:
-                            self.log(f"检测文件类型时出错: {str(e)}", 'warning')
+                    if is_animated:
+                        n_frames = img.n_frames
+                        # PIL保存时才按帧号读取durations，这里先占位，由帧生成器逐帧填写
+                        durations = [100] * n_frames
                         
-                        # 转换方法1：尝试使用ffmpeg进行转换（如果可用）
-                        converted = False
-                        if has_ffmpeg:
-                            self.log(f"使用ffmpeg转换文件: {file_basename}", 'info')
-                            # cmd = ['ffmpeg', '-i', file, '-vf', 'split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse', '-y', output_path]
-                            cmd = ['ffmpeg', '-i', file, '-y', output_path]                            
+                        # 逐帧读取并直接交给PIL保存，不在内存中保留整段动画
+                        self.log("开始处理动态WebP，共 %d 帧", n_frames, level='debug')
+                        frame_iter = self._iter_frames(img, durations, has_alpha)
+                        try:
                             try:
-                                self.log(f"执行命令: {' '.join(cmd)}", 'debug')
-                                process = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                                stderr_output = process.stderr.decode('utf-8', errors='ignore')
-                                
-                                # 检查输出文件是否存在且大小大于0
-                                if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                                    self.log(f"ffmpeg转换成功: {file_basename}", 'info')
-                                    success_count += 1
-                                    converted = True
-                                else:
-                                    error_msg = f"ffmpeg似乎运行成功，但没有生成有效的输出文件: {file_basename}"
-                                    self.log(error_msg, 'error')
-                                    self.log(f"ffmpeg错误输出: {stderr_output}", 'debug')
-                            except Exception as e:
-                                self.log(f"ffmpeg执行失败: {str(e)}", 'warning')
-                        
-                        # 转换方法2：尝试使用webptools
-                        if not converted and has_webptools:
-                            self.log(f"使用webptools转换文件: {file_basename}", 'info')
-                            try:
-                                # webptools dwebp只能转为PNG，所以我们需要先转为PNG，然后再转为GIF
-                                temp_png = os.path.join(output_dir, f"temp_{os.path.splitext(file_basename)[0]}.png")
-                                
-                                # 使用webptools转换为PNG
-                                result = dwebp(input_image=file, output_image=temp_png, option="-o", logging="-v")
-                                self.log(f"webptools处理结果: {result}", 'debug')
-                                
-                                if os.path.exists(temp_png) and os.path.getsize(temp_png) > 0:
-                                    # 使用PIL将PNG转为GIF
-                                    png_img = Image.open(temp_png)
-                                    png_img.save(output_path, 'GIF')
-                                    
-                                    # 删除临时PNG文件
-                                    os.remove(temp_png)
-                                    
-                                    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                                        self.log(f"webptools转换成功: {file_basename}", 'info')
-                                        success_count += 1
-                                        converted = True
-                                    else:
-                                        self.log(f"webptools转换到PNG成功，但PNG到GIF失败: {file_basename}", 'error')
-                                else:
-                                    self.log(f"webptools转换失败，没有生成PNG文件: {file_basename}", 'error')
+                                first_frame = next(frame_iter)
+                            except StopIteration:
+                                error_msg = f"无法提取帧，动画中没有可用的帧: {file_basename}"
+                                self.log(error_msg, level='error')
+                                return False, error_msg
                             except Exception as e:
                                 error_stack = traceback.format_exc()
-                                self.log(f"webptools处理出错: {str(e)}", 'error')
-                                self.log(f"错误堆栈: {error_stack}", 'debug')
-                        
-                        # 转换方法3：如果前面的方法都失败，尝试直接使用PIL
-                        if not converted:
-                            self.log(f"使用PIL尝试转换文件: {file_basename}", 'info')
+                                self.log(f"读取WebP帧时出错: {str(e)}", level='error')
+                                self.log("错误堆栈: %s", error_stack, level='debug')
+                                return False, f"读取{file_basename}的帧时出错: {str(e)}"
                             
+                            # 保存为GIF
+                            self.log("开始保存GIF，共 %d 帧", n_frames, level='debug')
                             try:
-                                # 尝试读取文件的前几个字节进行分析
-                                with open(file, 'rb') as f:
-                                    file_header = f.read(12)
-                                    self.log(f"文件头: {file_header.hex()}", 'debug')
-                                
-                                # 尝试用PIL打开
-                                img = Image.open(file)
-                                self.log(f"PIL成功打开文件: {file_basename}, 格式: {img.format}, 大小: {img.size}", 'debug')
+                                first_frame.save(
+                                    output_path,
+                                    format='GIF',
+                                    save_all=True,
+                                    append_images=frame_iter,
+                                    duration=durations,
+                                    loop=0,
+                                    disposal=2,
+                                    optimize=False
+                                )
                                 
-                                # 获取更多图像信息用于调试
-                                image_info = f"模式: {img.mode}, 格式: {img.format}"
-                                if hasattr(img, 'n_frames'):
-                                    image_info += f", 帧数: {img.n_frames}"
-                                self.log(f"图像信息: {image_info}", 'debug')
-                                
-                                # 检查是否为动态WebP
-                                is_animated = getattr(img, "is_animated", False)
-                                self.log(f"是否为动态WebP: {is_animated}", 'debug')
-                                
-                                if is_animated:
-                                    frames = []
-                                    durations = []
-                                    
-                                    # 获取所有帧
-                                    self.log(f"开始处理动态WebP，共 {img.n_frames} 帧", 'debug')
-                                    try:
-                                        for frame_idx in range(img.n_frames):
-                                            img.seek(frame_idx)
-                                            duration = img.info.get('duration', 100)
-                                            durations.append(duration)
-                                            
-                                            # 确保帧被正确转换
-                                            frame = img.convert('RGBA')
-                                            frames.append(frame.copy())
-                                            
-                                            self.log(f"处理第 {frame_idx+1}/{img.n_frames} 帧, 持续时间: {duration}ms", 'debug')
-                                    except Exception as e:
-                                        error_stack = traceback.format_exc()
-                                        self.log(f"读取WebP帧时出错: {str(e)}", 'error')
-                                        self.log(f"错误堆栈: {error_stack}", 'debug')
-                                        self.error.emit(f"读取{file_basename}的帧时出错: {str(e)}")
-                                        failed_count += 1
-                                        continue
-                                    
-                                    # 保存为GIF
-                                    if frames:
-                                        self.log(f"开始保存GIF，共 {len(frames)} 帧", 'debug')
-                                        try:
-                                            # 转换为RGB以避免透明度问题
-                                            rgb_frames = []
-                                            for frame in frames:
-                                                # 创建白色背景
-                                                bg = Image.new("RGB", frame.size, (255, 255, 255))
-                                                # 将RGBA图像粘贴到背景上
-                                                bg.paste(frame, (0, 0), frame.convert('RGBA'))
-                                                rgb_frames.append(bg)
-                                            
-                                            rgb_frames[0].save(
-                                                output_path,
-                                                format='GIF',
-                                                save_all=True,
-                                                append_images=rgb_frames[1:],
-                                                duration=durations,
-                                                loop=0,
-                                                disposal=2,
-                                                optimize=False
-                                            )
-                                            
-                                            # 验证输出文件
-                                            if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                                                self.log(f"GIF保存成功: {os.path.basename(output_path)}", 'info')
-                                                success_count += 1
-                                            else:
-                                                error_msg = f"GIF文件写入失败，输出文件为空或不存在: {os.path.basename(output_path)}"
-                                                self.log(error_msg, 'error')
-                                                self.error.emit(error_msg)
-                                                failed_count += 1
-                                                
-                                        except Exception as e:
-                                            error_stack = traceback.format_exc()
-                                            error_msg = f"保存GIF时出错: {str(e)}"
-                                            self.log(error_msg, 'error')
-                                            self.log(f"错误堆栈: {error_stack}", 'debug')
-                                            self.error.emit(f"保存{file_basename}为GIF时出错: {str(e)}")
-                                            failed_count += 1
-                                    else:
-                                        error_msg = f"无法提取帧，frames列表为空: {file_basename}"
-                                        self.log(error_msg, 'error')
-                                        self.error.emit(error_msg)
-                                        failed_count += 1
+                                # 验证输出文件
+                                output_size = _size_or_none(output_path)
+                                if output_size:
+                                    self.log(f"GIF保存成功: {os.path.basename(output_path)} ({output_size} 字节)", level='info')
+                                    return True, None
                                 else:
-                                    # 处理静态WebP
-                                    self.log(f"处理静态WebP: {file_basename}", 'debug')
-                                    try:
-                                        # 转换RGBA到RGB
-                                        img_rgb = Image.new("RGB", img.size, (255, 255, 255))
-                                        img_rgb.paste(img.convert('RGBA'), (0, 0), img.convert('RGBA'))
-                                        
-                                        img_rgb.save(output_path, 'GIF')
-                                        
-                                        # 验证输出文件
-                                        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                                            self.log(f"静态GIF保存成功: {os.path.basename(output_path)}", 'info')
-                                            success_count += 1
-                                        else:
-                                            error_msg = f"静态GIF文件写入失败，输出文件为空或不存在: {os.path.basename(output_path)}"
-                                            self.log(error_msg, 'error')
-                                            self.error.emit(error_msg)
-                                            failed_count += 1
-                                            
-                                    except Exception as e:
-                                        error_stack = traceback.format_exc()
-                                        error_msg = f"保存静态GIF时出错: {str(e)}"
-                                        self.log(error_msg, 'error')
-                                        self.log(f"错误堆栈: {error_stack}", 'debug')
-                                        self.error.emit(f"保存静态{file_basename}为GIF时出错: {str(e)}")
-                                        failed_count += 1
-                            
+                                    error_msg = f"GIF文件写入失败，输出文件为空或不存在: {os.path.basename(output_path)}"
+                                    self.log(error_msg, level='error')
+                                    return False, error_msg
+                                    
                             except Exception as e:
                                 error_stack = traceback.format_exc()
-                                error_msg = f"PIL处理过程出错: {str(e)}"
-                                self.log(error_msg, 'error')
-                                self.log(f"错误堆栈: {error_stack}", 'debug')
-                                self.error.emit(f"处理{file_basename}时出错: {str(e)}")
-                                failed_count += 1
-                    
-                    except Exception as e:
-                        error_stack = traceback.format_exc()
-                        error_msg = f"转换文件 {file_basename} 时出错: {str(e)}"
-                        self.log(error_msg, 'error')
-                        self.log(f"错误堆栈: {error_stack}", 'debug')
-                        self.error.emit(error_msg)
-                        failed_count += 1
-                        continue
-                else:
-                    self.log(f"跳过非WebP文件: {os.path.basename(file)}", 'warning')
+                                error_msg = f"保存GIF时出错: {str(e)}"
+                                self.log(error_msg, level='error')
+                                self.log("错误堆栈: %s", error_stack, level='debug')
+                                return False, f"保存{file_basename}为GIF时出错: {str(e)}"
+                        finally:
+                            # 关闭生成器，归还其占用的背景图
+                            frame_iter.close()
+                    else:
+                        # 处理静态WebP
+                        self.log("处理静态WebP: %s", file_basename, level='debug')
+                        img_rgb = None
+                        try:
+                            if has_alpha:
+                                # 转换RGBA到RGB
+                                img_rgba = img if img.mode == 'RGBA' else img.convert('RGBA')
+                                img_rgb = self._get_bg(img.size)
+                                img_rgb.paste(img_rgba, mask=img_rgba)
+                                
+                                img_rgb.save(output_path, 'GIF')
+                            else:
+                                # 不透明图像直接量化为调色板后保存
+                                img.convert('P', palette=Image.Palette.ADAPTIVE).save(output_path, 'GIF')
+                            
+                            # 验证输出文件
+                            output_size = _size_or_none(output_path)
+                            if output_size:
+                                self.log(f"静态GIF保存成功: {os.path.basename(output_path)} ({output_size} 字节)", level='info')
+                                return True, None
+                            else:
+                                error_msg = f"静态GIF文件写入失败，输出文件为空或不存在: {os.path.basename(output_path)}"
+                                self.log(error_msg, level='error')
+                                return False, error_msg
+                                
+                        except Exception as e:
+                            error_stack = traceback.format_exc()
+                            error_msg = f"保存静态GIF时出错: {str(e)}"
+                            self.log(error_msg, level='error')
+                            self.log("错误堆栈: %s", error_stack, level='debug')
+                            return False, f"保存静态{file_basename}为GIF时出错: {str(e)}"
+                        finally:
+                            if img_rgb is not None:
+                                self._put_bg(img_rgb)
                 
-                self.progress.emit(int((i / total) * 100))
+            except Exception as e:
+                error_stack = traceback.format_exc()
+                error_msg = f"PIL处理过程出错: {str(e)}"
+                self.log(error_msg, level='error')
+                self.log("错误堆栈: %s", error_stack, level='debug')
+                pil_error_msg = f"处理{file_basename}时出错: {str(e)}"
+            
+            # 转换方法4：PIL无法处理时（例如Pillow未编译WebP支持），尝试使用dwebp解码
+            if tools.get('dwebp', False):
+                self.log(f"使用dwebp转换文件: {file_basename}", level='info')
+                try:
+                    if self._convert_with_dwebp(file, output_path):
+                        self.log(f"dwebp转换成功: {file_basename}", level='info')
+                        return True, None
+                    self.log(f"dwebp没有生成有效的输出文件: {file_basename}", level='error')
+                except Exception as e:
+                    error_stack = traceback.format_exc()
+                    self.log(f"dwebp处理出错: {str(e)}", level='error')
+                    self.log("错误堆栈: %s", error_stack, level='debug')
+            
+            return False, pil_error_msg
+        
+        except Exception as e:
+            error_stack = traceback.format_exc()
+            error_msg = f"转换文件 {file_basename} 时出错: {str(e)}"
+            self.log(error_msg, level='error')
+            self.log("错误堆栈: %s", error_stack, level='debug')
+            return False, error_msg
+
+    def run(self):
+        try:
+            # 检查可用工具
+            tools = check_tools()
+            self.log(f"可用转换工具: ffmpeg={tools['ffmpeg']}, PyAV={tools['pyav']}, dwebp={tools['dwebp']}", level='info')
+            if self.debug_mode and tools['ffmpeg']:
+                ffmpeg_version = get_ffmpeg_version()
+                if ffmpeg_version:
+                    self.log("ffmpeg版本: %s", ffmpeg_version, level='debug')
+            
+            total = len(self.files)
+            success_count = 0
+            failed_count = 0
+            done = 0
+            last_pct = -1
+            
+            self.log(f"开始转换 {total} 个文件")
+            
+            # 非WebP文件直接跳过，不进入线程池
+            webp_files = []
+            for i, file in enumerate(self.files, 1):
+                if file.lower().endswith('.webp'):
+                    webp_files.append((i, file))
+                else:
+                    self.log(f"跳过非WebP文件: {os.path.basename(file)}", level='warning')
+                    done += 1
+            
+            # 每个文件的转换相互独立，且主要耗时在子进程和文件I/O上，使用线程池并行处理
+            max_workers = min(8, os.cpu_count() or 4)
+            self.log("并行转换线程数: %d", max_workers, level='debug')
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(self._convert_one, file, i, total, tools)
+                           for i, file in webp_files]
+                for future in as_completed(futures):
+                    ok, err = future.result()
+                    done += 1
+                    if ok:
+                        success_count += 1
+                    else:
+                        failed_count += 1
+                        if err:
+                            self.error.emit(err)
+                    if (success_count + failed_count) % GC_COLLECT_EVERY == 0:
+                        gc.collect()
+                    # 仅在百分比变化时通知界面
+                    pct = done * 100 // total
+                    if pct != last_pct:
+                        self.progress.emit(pct)
+                        last_pct = pct
+            
+            with self._bg_lock:
+                self._bg_pool.clear()
             
             summary_msg = f"转换完成: 成功 {success_count}，失败 {failed_count}，总共 {total}"
-            self.log(summary_msg, 'info')
+            self.log(summary_msg, level='info')
+            self.flush_log()
             self.finished.emit()
         except Exception as e:
             error_stack = traceback.format_exc()
             error_msg = f"转换过程中发生异常: {str(e)}"
-            self.log(error_msg, 'error')
-            self.log(f"错误堆栈: {error_stack}", 'debug')
+            self.log(error_msg, level='error')
+            self.log("错误堆栈: %s", error_stack, level='debug')
+            self.flush_log()
             self.error.emit(error_msg)
 
 class DropArea(QLabel):
@@ -484,21 +771,30 @@ class MainWindow(QMainWindow):
         self.log_text.setReadOnly(True)
         self.log_text.setFixedHeight(150)
         self.log_text.setPlaceholderText("日志信息将显示在这里...")
+        # 限制日志最大行数，超出后自动丢弃最早的行，避免长时间运行后界面卡顿
+        self.log_text.document().setMaximumBlockCount(LOG_MAX_BLOCKS)
         layout.addWidget(self.log_text)
         
         # 添加初始日志
         self.append_log("程序已启动，等待转换任务...")
         self.append_log(f"日志文件路径: {log_file}")
 
+        # 定时取出工作线程缓冲中的日志，避免转换工具长时间运行时界面日志滞后
+        self.worker = None
+        self.log_flush_timer = QTimer(self)
+        self.log_flush_timer.setInterval(int(LOG_FLUSH_INTERVAL * 1000))
+        self.log_flush_timer.timeout.connect(self.flush_worker_log)
+
         # 设置窗口属性
         self.setFixedSize(600, 650)
         self.setWindowFlags(Qt.WindowType.WindowStaysOnTopHint)
 
     def append_log(self, message):
-        """向日志文本框添加消息"""
-        self.log_text.append(f"[{datetime.now().strftime('%H:%M:%S')}] {message}")
+        """向日志文本框添加消息，工作线程可能一次发送多行合并后的日志"""
+        timestamp = datetime.now().strftime('%H:%M:%S')
+        self.log_text.append('\n'.join(f"[{timestamp}] {line}" for line in message.split('\n')))
         # 自动滚动到底部
-        self.log_text.verticalScrollBar().setValue(self.log_text.verticalScrollBar().maximum())
+        self.log_text.moveCursor(QTextCursor.MoveOperation.End)
 
     def select_files(self):
         files, _ = QFileDialog.getOpenFileNames(
@@ -534,6 +830,16 @@ class MainWindow(QMainWindow):
         self.worker.error.connect(self.conversion_error)
         self.worker.log_message.connect(self.append_log)
         self.worker.start()
+        self.log_flush_timer.start()
+
+    def flush_worker_log(self):
+        """定时器回调：取出工作线程缓冲中的日志，工作线程结束后停止定时器"""
+        if self.worker is None:
+            self.log_flush_timer.stop()
+            return
+        self.worker.flush_log()
+        if self.worker.isFinished():
+            self.log_flush_timer.stop()
 
     def update_progress(self, value):
         self.progress_bar.setValue(value)
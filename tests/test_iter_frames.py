@@ -0,0 +1,84 @@
+import os
+import sys
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("PyQt6.QtCore")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main  # noqa: E402
+
+COLORS = [(255, 255, 255), (255, 0, 0), (0, 255, 0), (0, 0, 255)]
+DURATIONS = [50, 100, 150, 200]
+NO_TOOLS = {'pyav': False, 'ffmpeg': False, 'dwebp': False}
+
+
+@pytest.fixture
+def white_first_webp(tmp_path):
+    """白色首帧之后依次为红、绿、蓝的无损动态WebP"""
+    frames = [Image.new("RGB", (32, 32), color) for color in COLORS]
+    path = tmp_path / "fade.webp"
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=DURATIONS, lossless=True)
+    return path
+
+
+def test_iter_frames_keeps_colors_missing_from_first_frame(white_first_webp):
+    worker = main.ConversionWorker([])
+    with Image.open(white_first_webp) as img:
+        durations = [0] * img.n_frames
+        frames = [frame.convert("RGB").getpixel((0, 0))
+                  for frame in worker._iter_frames(img, durations, has_alpha=False)]
+    assert frames == COLORS
+    assert durations == DURATIONS
+
+
+def test_convert_one_white_first_frame_gif_keeps_all_frames(white_first_webp):
+    worker = main.ConversionWorker([str(white_first_webp)])
+    ok, err = worker._convert_one(str(white_first_webp), 1, 1, NO_TOOLS)
+    assert ok, err
+
+    output_path = white_first_webp.parent / "result" / "fade.gif"
+    with Image.open(output_path) as gif:
+        assert gif.n_frames == len(COLORS)
+        colors = []
+        durations = []
+        for frame_idx in range(gif.n_frames):
+            gif.seek(frame_idx)
+            colors.append(gif.convert("RGB").getpixel((0, 0)))
+            durations.append(gif.info["duration"])
+    assert colors == COLORS
+    assert durations == DURATIONS
+
+
+def test_pyav_composites_transparent_pixels_onto_white(tmp_path):
+    pytest.importorskip("av")
+    img = Image.new("RGBA", (32, 32), (0, 0, 0, 0))
+    img.paste((255, 0, 0, 255), (8, 8, 24, 24))
+    path = tmp_path / "static_a.webp"
+    img.save(path, lossless=True)
+
+    worker = main.ConversionWorker([str(path)])
+    output_path = tmp_path / "static_a.gif"
+    assert worker._convert_with_pyav(str(path), str(output_path))
+    with Image.open(output_path) as gif:
+        rgb = gif.convert("RGB")
+        assert rgb.getpixel((0, 0)) == (255, 255, 255)
+        assert rgb.getpixel((16, 16)) == (255, 0, 0)
+
+
+def test_pyav_single_frame_saved_as_static_gif(tmp_path):
+    av = pytest.importorskip("av")
+    path = tmp_path / "static.webp"
+    Image.new("RGB", (32, 32), (0, 0, 255)).save(path, quality=90)
+
+    worker = main.ConversionWorker([str(path)])
+    with av.open(str(path)) as container:
+        frame = next(container.decode(video=0))
+        assert worker._av_frame_to_image(frame).mode == "RGB"
+
+    output_path = tmp_path / "static.gif"
+    assert worker._convert_with_pyav(str(path), str(output_path))
+    with Image.open(output_path) as gif:
+        assert not getattr(gif, "is_animated", False)
+        assert "duration" not in gif.info